@@ -26,4 +26,8 @@ def create_app():
     from .routes import bp as routes_bp
     app.register_blueprint(routes_bp)
 
+    # Flush background services on SIGTERM too, not only on a normal exit
+    from .logic import install_sigterm_handler
+    install_sigterm_handler()
+
     return app
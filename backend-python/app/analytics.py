@@ -0,0 +1,208 @@
+"""Session analytics module.
+
+This module records every completed diagnostic session (answers, path, score,
+recommendation and timings) to an append-only SQLite log. Records are handed
+to a background writer through a bounded queue and inserted in batches, so
+the request that completes a session never waits on disk I/O.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+_STOP = object()
+
+# The log is the lasting record of every diagnosis, so by default it goes in the
+# app's instance folder (like the session snapshots), not the temp dir
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "session_log.db")
+
+
+class SessionLogWriter:
+    """Write-behind, batched, append-only log of completed sessions."""
+
+    # Wait between attempts to open the log when the file cannot be opened
+    CONNECT_RETRY_SECONDS = 5.0
+
+    def __init__(self, path, batch_size=200, flush_interval=1.0, max_queue=10000, enqueue_timeout=0.0):
+        """
+        Args:
+            path (str): SQLite file to append to
+            batch_size (int): Records per insert transaction
+            flush_interval (float): Longest time a record waits before being written
+            max_queue (int): Records held in memory before new ones are dropped
+            enqueue_timeout (float): How long record() may block when the queue
+                                     is full; 0 drops immediately
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "batches": 0, "write_errors": 0}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="session-log-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls):
+        """Build a writer from the ANALYTICS_* environment variables."""
+        return cls(
+            path=os.getenv("ANALYTICS_DB") or DEFAULT_PATH,
+            batch_size=int(os.getenv("ANALYTICS_BATCH_SIZE", 200)),
+            flush_interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", 1.0)),
+            max_queue=int(os.getenv("ANALYTICS_MAX_QUEUE", 10000)),
+            enqueue_timeout=float(os.getenv("ANALYTICS_ENQUEUE_TIMEOUT", 0.0)),
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record(self, entry):
+        """
+        Queue a completed session for writing.
+
+        Never touches disk. When the queue is full the record is dropped (after
+        waiting up to enqueue_timeout) rather than letting memory grow.
+
+        Args:
+            entry (dict): Output of DiagnosticSession.to_log_record
+
+        Returns:
+            bool: True if queued, False if dropped
+        """
+        if self._closed:
+            self._count("dropped")
+            return False
+        try:
+            if self.enqueue_timeout > 0:
+                self._queue.put(entry, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT,
+                started_at REAL,
+                completed_at REAL,
+                duration_seconds REAL,
+                answers TEXT,
+                path TEXT,
+                score INTEGER,
+                recommendation TEXT,
+                timings TEXT
+            )
+        """)
+        conn.commit()
+        return conn
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO session_log (session_id, started_at, completed_at, duration_seconds, answers, path, score, recommendation, timings) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(
+                        entry["session_id"],
+                        entry["started_at"],
+                        entry["completed_at"],
+                        entry["completed_at"] - entry["started_at"],
+                        json.dumps(entry["answers"]),
+                        json.dumps(entry["path"]),
+                        entry["score"],
+                        entry["recommendation"],
+                        json.dumps(entry["timings"]),
+                    ) for entry in batch]
+                )
+            self._count("written", len(batch))
+            self._count("batches")
+        except (sqlite3.Error, KeyError, TypeError):
+            self._count("write_errors", len(batch))
+
+    def _connect_with_retry(self):
+        """
+        Open the log, retrying until it works or the writer is closed.
+
+        Records keep queueing (and are dropped once the queue is full) meanwhile.
+
+        Returns:
+            sqlite3.Connection or None: None if the writer was closed first
+        """
+        while True:
+            try:
+                return self._connect()
+            except (sqlite3.Error, OSError):
+                self._count("write_errors")
+            if self._closed:
+                return None
+            time.sleep(self.CONNECT_RETRY_SECONDS)
+
+    def _run(self):
+        conn = self._connect_with_retry()
+        if conn is None:
+            return
+        batch = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                entry = self._queue.get(timeout=timeout)
+                if entry is _STOP:
+                    stopping = True
+                else:
+                    batch.append(entry)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(conn, batch)
+                batch = []
+                deadline = None
+
+        # Drain anything queued behind the stop marker
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                batch.append(entry)
+        if batch:
+            self._write(conn, batch)
+        conn.close()
+
+    def close(self, timeout=10.0):
+        """Stop accepting records, flush everything queued and stop the writer."""
+        if self._closed:
+            return
+        self._closed = True
+        # The writer is draining, so room for the stop marker frees up quickly
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {**counters, "queue_depth": self._queue.qsize()}
+
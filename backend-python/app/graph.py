@@ -0,0 +1,136 @@
+"""Diagnostic graph module.
+
+This module defines the weighted question graph behind the diagnostic flow and
+the walk that turns a set of answers into a recommendation. It has no side
+effects on import, so offline tools can use it without starting the app's
+services.
+"""
+
+import json
+import networkx as nx
+from icecream import ic
+
+# Edges as (source question index, target question index, answer, weight); -1 is "Run Algorithm".
+# Weights reflect the likelihood of needing a router restart. Tuned replacements
+# can be produced offline with `python -m app.tuning` and loaded via DIAGNOSTIC_GRAPH_PATH.
+DEFAULT_EDGES = [
+    (0, 1, True, -2),
+    (0, -1, False, 5),
+    (1, 2, True, -2),
+    (1, -1, False, 4),
+    (2, 3, True, 4),
+    (2, -1, False, 5),
+
+    (3, 4, True, 4),
+    (3, 4, False, -3),
+    (4, 5, True, 3),
+    (4, 5, False, -2),
+    (5, 6, True, 3),
+    (5, 6, False, -2),
+    (6, 7, True, 2),
+    (6, 7, False, -2),
+    (7, 8, True, 3),
+    (7, 8, False, -2),
+    (8, -1, True, 3),
+    (8, -1, False, -3),
+]
+
+def load_graph_definition(path):
+    """
+    Load edges from a graph definition JSON file written by the tuning tool.
+
+    Args:
+        path (str): Path to the JSON file
+
+    Returns:
+        list: Edges in the same (source, target, answer, weight) form as DEFAULT_EDGES
+    """
+    with open(path) as f:
+        definition = json.load(f)
+    return [(edge["source"], edge["target"], edge["answer"], edge["weight"]) for edge in definition["edges"]]
+
+class RouterDiagnosticGraph:
+    def __init__(self, edges=None):
+        self.graph = nx.MultiDiGraph()
+        self.questions = [
+            "Is your wifi router POWER LED on?",
+            "Is router/modem connected to the internet? (Is the 'internet' LED solid?)",
+            "Does visiting 192.168.1.1 take you to router login page?",
+            "Are there other devices that are having internet issues?",
+            "Do you keep connecting and reconnecting to the internet?",
+            "Do non-working websites work when connected via mobile data instead of wifi?",
+            "Is there noticeable lag and buffering in games and videos?",
+            "Are there spikes and drops in internet speed?",
+            "No networking apps such as VPNs have been recently installed on your device?",
+            "Run Algorithm"
+        ]
+        self.edges = DEFAULT_EDGES if edges is None else edges
+        self._build_graph()
+        
+    def _build_graph(self):
+        for question in self.questions:
+            self.graph.add_node(question, visited_count=0, answer=None)
+        
+        for source, target, answer, weight in self.edges:
+            self.graph.add_edge(self.questions[source], self.questions[target], answer=answer, weight=weight)
+    
+    def get_recommendation(self, answers):
+        """
+        Process user answers through the decision graph.
+        
+        Args:
+            answers (dict): Dictionary mapping question indices to boolean answers
+            
+        Returns:
+            dict: Contains recommendation and score
+        """
+        current_node = self.questions[0]
+        score = 0
+        path = []
+        
+        while current_node != self.questions[-1]:
+            path.append(current_node)
+            question_index = self.questions.index(current_node)
+            
+            if question_index not in answers:
+                break
+                
+            user_answer = answers[question_index]
+            if user_answer.lower() in ["yes", "y", "true", "t"]:
+                user_answer = True
+            elif user_answer.lower() in ["no", "n", "false", "f"]:
+                user_answer = False
+            elif user_answer.lower() == "?":
+                user_answer = "?"
+
+            self.graph.nodes[current_node]["answer"] = user_answer
+            self.graph.nodes[current_node]["visited_count"] += 1
+            
+            next_node = None
+            for _, target, data in self.graph.out_edges(current_node, data=True):
+                ic(score)
+                if type(user_answer) == str and user_answer.lower() == "?":
+                    out_edges_sum = sum(data.get("weight", 0) for _, _, data in self.graph.out_edges(current_node, data=True))
+                    score += out_edges_sum
+                    next_node = target
+                    break
+
+                elif data.get("answer") == user_answer:
+                    score += data.get("weight", 0)
+                    next_node = target
+                    break
+            
+            if next_node is None:
+                break
+                
+            current_node = next_node
+        
+        recommendation = "RESTART_ROUTER" if score >= 0 else "CONTACT_SUPPORT"
+        
+        return {
+            "recommendation": recommendation,
+            "score": score,
+            "path": path,
+            "reasoning": f"Based on the info you have provided. I recommend " + "restarting your router" if score >= 0 else
+                         "contacting technical support at +1-ROUTHIS4ME for further assistance. I'm sorry I could not be of much help :("
+        }
@@ -0,0 +1,188 @@
+"""Hedged request module.
+
+This module wraps blocking upstream calls (the OpenAI completions used by the
+chat routes) so that a slow call can be raced against a duplicate. If the
+first attempt has not answered by a percentile of recently observed latencies,
+a second attempt is fired and whichever answers first is returned. A global
+budget caps how many extra calls hedging is allowed to make.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class LatencyTracker:
+    """Rolling window of upstream latencies used to pick the hedge deadline."""
+
+    def __init__(self, window=500, percentile=95, min_samples=20, default_delay=2.0, min_delay=0.25):
+        self.samples = deque(maxlen=window)
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def deadline(self):
+        """
+        Get how long to wait on the first attempt before hedging.
+
+        Returns:
+            float: Seconds to wait; the default delay until enough samples exist
+        """
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(self.samples)
+
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+
+class HedgeBudget:
+    """
+    Token bucket limiting hedges to a fraction of primary calls.
+
+    Every primary call deposits `ratio` tokens (capped at `burst`) and every
+    hedge spends one, so over time hedges never exceed `ratio` of traffic.
+    """
+
+    def __init__(self, ratio=0.05, burst=5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class HedgedCaller:
+    """Runs a callable with optional hedging and keeps hedge metrics."""
+
+    def __init__(self, enabled=False, percentile=95, budget_ratio=0.05, budget_burst=5.0,
+                 default_delay=2.0, min_delay=0.25, max_workers=16):
+        self.enabled = enabled
+        self.tracker = LatencyTracker(percentile=percentile, default_delay=default_delay, min_delay=min_delay)
+        self.budget = HedgeBudget(ratio=budget_ratio, burst=budget_burst)
+        self.counters = {
+            "calls": 0,
+            "hedges_fired": 0,
+            "hedges_won": 0,
+            "hedges_skipped_budget": 0,
+        }
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-hedge") if enabled else None
+
+    @classmethod
+    def from_env(cls):
+        """Build a caller from the LLM_HEDGE_* environment variables."""
+        return cls(
+            enabled=os.getenv("LLM_HEDGING_ENABLED", "false").lower() in ["1", "true", "yes"],
+            percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 95)),
+            budget_ratio=float(os.getenv("LLM_HEDGE_BUDGET", 0.05)),
+            default_delay=float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 2.0)),
+            min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", 0.25)),
+            # Room for every admitted primary, its hedge, and losers still finishing in the background
+            max_workers=int(os.getenv("LLM_HEDGE_WORKERS") or 4 * int(os.getenv("RATE_LIMIT_LLM_MAX_INFLIGHT", 8))),
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _timed(self, fn, args, kwargs, started=None):
+        if started is not None:
+            started.set()
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        return result, time.monotonic() - start
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call `fn`, hedging with a duplicate call if the first one is slow.
+
+        Args:
+            fn (callable): The blocking upstream call
+            *args, **kwargs: Passed through to `fn`
+
+        Returns:
+            The result of whichever attempt succeeded first. If every attempt
+            fails, the exception from the first attempt is raised.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        self._count("calls")
+        self.budget.deposit()
+
+        started = threading.Event()
+        primary = self._executor.submit(self._timed, fn, args, kwargs, started)
+        # Every successful primary feeds the tracker (hedge attempts never do), timed from
+        # when it started running, so the deadline follows the upstream distribution
+        primary.add_done_callback(self._record_latency)
+
+        # Count the deadline from when the primary starts, not from when it was queued,
+        # so a busy pool does not make every queued call look slow and burn the budget
+        started.wait()
+        done, _ = wait([primary], timeout=self.tracker.deadline())
+        if done:
+            return primary.result()[0]
+
+        if not self.budget.try_spend():
+            self._count("hedges_skipped_budget")
+            return primary.result()[0]
+
+        self._count("hedges_fired")
+        hedge = self._executor.submit(self._timed, fn, args, kwargs)
+        pending = {primary, hedge}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedges_won")
+                    return future.result()[0]
+
+        return primary.result()[0]
+
+    def _record_latency(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.tracker.record(future.result()[1])
+
+    def metrics(self):
+        """
+        Get hedging counters and derived rates.
+
+        Returns:
+            dict: Counters plus hedge_rate (hedges per call), win_rate
+                  (hedges that beat the primary) and the current deadline
+        """
+        with self._lock:
+            counters = dict(self.counters)
+
+        calls = counters["calls"]
+        fired = counters["hedges_fired"]
+        return {
+            "enabled": self.enabled,
+            **counters,
+            "hedge_rate": fired / calls if calls else 0.0,
+            "win_rate": counters["hedges_won"] / fired if fired else 0.0,
+            "deadline_seconds": self.tracker.deadline(),
+            "budget_ratio": self.budget.ratio,
+        }
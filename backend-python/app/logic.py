@@ -4,11 +4,19 @@ This module contains the core business logic for the application,
 including AI service integrations and data processing.
 """
 
+import atexit
 import os
-import networkx as nx
+import signal
+import sys
+import threading
+import time
 from openai import OpenAI
 from dotenv import load_dotenv
 from icecream import ic
+from .graph import load_graph_definition, RouterDiagnosticGraph
+from .hedging import HedgedCaller
+from .analytics import SessionLogWriter
+from .sessions import SessionStore
 
 AI_PROMPT = """You are RouteThis, a friendly AI assistant specifically designed to help users troubleshoot router and WiFi connectivity issues. You have a warm, conversational personality and make users feel comfortable while staying strictly focused on router troubleshooting.
 
@@ -25,108 +33,6 @@ INITIAL GREETING: When users first reach out, respond warmly: "Hello! I'm RouteT
 
 DIAGNOSTIC QUESTIONS: After understanding their issue, explain you'll ask some questions to diagnose the problem properly, then proceed with systematic troubleshooting to determine if a router restart is needed."""
 
-class RouterDiagnosticGraph:
-    def __init__(self):
-        self.graph = nx.MultiDiGraph()
-        self.questions = [
-            "Is your wifi router POWER LED on?",
-            "Is router/modem connected to the internet? (Is the 'internet' LED solid?)",
-            "Does visiting 192.168.1.1 take you to router login page?",
-            "Are there other devices that are having internet issues?",
-            "Do you keep connecting and reconnecting to the internet?",
-            "Do non-working websites work when connected via mobile data instead of wifi?",
-            "Is there noticeable lag and buffering in games and videos?",
-            "Are there spikes and drops in internet speed?",
-            "No networking apps such as VPNs have been recently installed on your device?",
-            "Run Algorithm"
-        ]
-        self._build_graph()
-        
-    def _build_graph(self):
-        for question in self.questions:
-            self.graph.add_node(question, visited_count=0, answer=None)
-        
-        # Add edges with weights based on likelihood of needing router restart
-        self.graph.add_edge(self.questions[0], self.questions[1], answer=True, weight=-2)
-        self.graph.add_edge(self.questions[0], self.questions[-1], answer=False, weight=5)
-        self.graph.add_edge(self.questions[1], self.questions[2], answer=True, weight=-2)
-        self.graph.add_edge(self.questions[1], self.questions[-1], answer=False, weight=4)
-        self.graph.add_edge(self.questions[2], self.questions[3], answer=True, weight=4)
-        self.graph.add_edge(self.questions[2], self.questions[-1], answer=False, weight=5)
-        
-        self.graph.add_edge(self.questions[3], self.questions[4], answer=True, weight=4)
-        self.graph.add_edge(self.questions[3], self.questions[4], answer=False, weight=-3)
-        self.graph.add_edge(self.questions[4], self.questions[5], answer=True, weight=3)
-        self.graph.add_edge(self.questions[4], self.questions[5], answer=False, weight=-2)
-        self.graph.add_edge(self.questions[5], self.questions[6], answer=True, weight=3)
-        self.graph.add_edge(self.questions[5], self.questions[6], answer=False, weight=-2)
-        self.graph.add_edge(self.questions[6], self.questions[7], answer=True, weight=2)
-        self.graph.add_edge(self.questions[6], self.questions[7], answer=False, weight=-2)
-        self.graph.add_edge(self.questions[7], self.questions[8], answer=True, weight=3)
-        self.graph.add_edge(self.questions[7], self.questions[8], answer=False, weight=-2)
-        self.graph.add_edge(self.questions[8], self.questions[-1], answer=True, weight=3)
-        self.graph.add_edge(self.questions[8], self.questions[-1], answer=False, weight=-3)
-    
-    def get_recommendation(self, answers):
-        """
-        Process user answers through the decision graph.
-        
-        Args:
-            answers (dict): Dictionary mapping question indices to boolean answers
-            
-        Returns:
-            dict: Contains recommendation and score
-        """
-        current_node = self.questions[0]
-        score = 0
-        path = []
-        
-        while current_node != self.questions[-1]:
-            path.append(current_node)
-            question_index = self.questions.index(current_node)
-            
-            if question_index not in answers:
-                break
-                
-            user_answer = answers[question_index]
-            if user_answer.lower() in ["yes", "y", "true", "t"]:
-                user_answer = True
-            elif user_answer.lower() in ["no", "n", "false", "f"]:
-                user_answer = False
-            elif user_answer.lower() == "?":
-                user_answer = "?"
-
-            self.graph.nodes[current_node]["answer"] = user_answer
-            self.graph.nodes[current_node]["visited_count"] += 1
-            
-            next_node = None
-            for _, target, data in self.graph.out_edges(current_node, data=True):
-                ic(score)
-                if type(user_answer) == str and user_answer.lower() == "?":
-                    out_edges_sum = sum(data.get("weight", 0) for _, _, data in self.graph.out_edges(current_node, data=True))
-                    score += out_edges_sum
-                    next_node = target
-                    break
-
-                elif data.get("answer") == user_answer:
-                    score += data.get("weight", 0)
-                    next_node = target
-                    break
-            
-            if next_node is None:
-                break
-                
-            current_node = next_node
-        
-        recommendation = "RESTART_ROUTER" if score >= 0 else "CONTACT_SUPPORT"
-        
-        return {
-            "recommendation": recommendation,
-            "score": score,
-            "path": path,
-            "reasoning": f"Based on the info you have provided. I recommend " + "restarting your router" if score >= 0 else
-                         "contacting technical support at +1-ROUTHIS4ME for further assistance. I'm sorry I could not be of much help :("
-        }
 # Load environment variables
 load_dotenv()
 
@@ -135,9 +41,88 @@ client = OpenAI(
     api_key=os.getenv("OPENAI_API_KEY", "your_openai_api_key_here")
 )
 
+# Services that start threads or open files are created on first use rather than
+# at import, so tools that only need part of this module start none of them
+_services = {}
+_services_lock = threading.Lock()
+
+def _service(name, factory):
+    service = _services.get(name)
+    if service is None:
+        with _services_lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = factory()
+    return service
+
+def shutdown_services():
+    """Flush and stop whichever background services have been started; safe to call twice."""
+    with _services_lock:
+        services = list(_services.values())
+    for service in services:
+        if hasattr(service, "close"):
+            # One failing service must not keep the others from flushing
+            try:
+                service.close()
+            except Exception as e:
+                ic(e)
+
+atexit.register(shutdown_services)
+
+def install_sigterm_handler():
+    """
+    Make SIGTERM exit normally, so the atexit hook above still flushes the services.
+
+    Only the default action is replaced. A server's own handler (e.g. gunicorn's
+    graceful stop) is left alone: it lets in-flight requests finish and then exits
+    normally, which runs the hook too. Nothing is flushed inside the handler,
+    since it may interrupt the main thread while it holds a lock the flush needs.
+    Signal handlers can only be set from the main thread, so elsewhere this does nothing.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+def _exit_on_sigterm(signum, frame):
+    sys.exit(128 + signum)
 
-# Initialize diagnostic graph
-diagnostic_graph = RouterDiagnosticGraph()
+def get_llm_hedger():
+    """Get the hedged caller for upstream calls (see LLM_HEDGE_* in .env.template)."""
+    return _service("llm_hedger", HedgedCaller.from_env)
+
+def create_chat_completion(**kwargs):
+    """
+    Create a chat completion, hedged against slow upstream responses if enabled.
+
+    Args:
+        **kwargs: Arguments for client.chat.completions.create
+
+    Returns:
+        The completion response from whichever attempt answered first
+    """
+    return get_llm_hedger().call(client.chat.completions.create, **kwargs)
+
+def get_llm_metrics():
+    """Get hedge rate, win rate and related counters for the LLM call path."""
+    return get_llm_hedger().metrics()
+
+def get_session_log():
+    """Get the write-behind log of completed sessions (see ANALYTICS_* in .env.template)."""
+    return _service("session_log", SessionLogWriter.from_env)
+
+def get_analytics_metrics():
+    """Get queue depth and written/dropped counters for the session analytics log."""
+    return get_session_log().metrics()
+
+def get_session_store_metrics():
+    """Get snapshot and lazy-restore counters for the active session store."""
+    return get_active_sessions().metrics()
+
+
+# Initialize diagnostic graph, with tuned edge weights if a definition is configured
+graph_definition_path = os.getenv("DIAGNOSTIC_GRAPH_PATH")
+diagnostic_graph = RouterDiagnosticGraph(load_graph_definition(graph_definition_path) if graph_definition_path else None)
 
 def get_gpt_response(user_message):
     """
@@ -150,7 +135,7 @@ def get_gpt_response(user_message):
         str: GPT's response or error message
     """
     try:
-        response = client.chat.completions.create(
+        response = create_chat_completion(
             model="gpt-4o-mini",  # Cheapest GPT model available
             messages=[
                 {
@@ -184,12 +169,24 @@ def get_diagnostic_recommendation(answers):
 
 class DiagnosticSession:
     """Manages a single diagnostic session with state tracking."""
+
+    # Order of the fields in a snapshot state list (see to_state)
+    STATE_FIELDS = ("current_question_index", "answers", "completed", "recommendation",
+                    "started_at", "completed_at", "answer_times", "recommendation_seconds")
     
-    def __init__(self):
+    def __init__(self, session_id=None):
+        self.session_id = session_id
         self.current_question_index = 0
         self.answers = {}
         self.completed = False
         self.recommendation = None
+        self.started_at = time.time()
+        self.completed_at = None
+        self.answer_times = []
+        self.recommendation_seconds = None
+        # Held while answering and while taking a snapshot state, so the snapshot
+        # thread never reads a session halfway through an update
+        self._lock = threading.Lock()
         self.conversational_intros = [
             "Great! Let me start by checking the basics. ",
             "Perfect, that helps me understand the situation. Now, ",
@@ -221,11 +218,16 @@ class DiagnosticSession:
     
     def answer_question(self, answer):
         """Answer the current question and advance to next."""
+        with self._lock:
+            return self._answer_question(answer)
+
+    def _answer_question(self, answer):
         if self.completed:
             return {"error": "Session already completed"}
         
         # Store the answer
         self.answers[self.current_question_index] = answer
+        self.answer_times.append(time.time() - self.started_at)
         
         # Check if we should skip to end based on graph logic
         current_node = diagnostic_graph.questions[self.current_question_index]
@@ -245,9 +247,8 @@ class DiagnosticSession:
                     break
         
         if next_node == diagnostic_graph.questions[-1]:  # "Run Algorithm"
-            self.completed = True
             ic(self.answers)
-            self.recommendation = diagnostic_graph.get_recommendation(self.answers)
+            self._complete()
             return {
                 "complete": True,
                 "recommendation": self.recommendation,
@@ -259,8 +260,7 @@ class DiagnosticSession:
         
         # Check if we've reached the end
         if self.current_question_index >= len(diagnostic_graph.questions) - 1:
-            self.completed = True
-            self.recommendation = diagnostic_graph.get_recommendation(self.answers)
+            self._complete()
             return {
                 "complete": True,
                 "recommendation": self.recommendation,
@@ -274,26 +274,82 @@ class DiagnosticSession:
             "recommendation": None
         }
 
-# Store active sessions (in production, use Redis or database)
-active_sessions = {}
+    def _complete(self):
+        """Mark the session complete, compute the recommendation and log it."""
+        start = time.perf_counter()
+        self.recommendation = diagnostic_graph.get_recommendation(self.answers)
+        self.recommendation_seconds = time.perf_counter() - start
+        self.completed = True
+        self.completed_at = time.time()
+        get_session_log().record(self.to_log_record())
+
+    def to_state(self):
+        """Get a compact, JSON-serializable snapshot of this session's progress."""
+        with self._lock:
+            return [
+                self.current_question_index,
+                dict(self.answers),
+                self.completed,
+                self.recommendation,
+                round(self.started_at, 3),
+                self.completed_at,
+                [round(seconds, 3) for seconds in self.answer_times],
+                self.recommendation_seconds
+            ]
+
+    @classmethod
+    def from_state(cls, session_id, state):
+        """Rebuild a session from a to_state snapshot."""
+        session = cls(session_id)
+        for field, value in zip(cls.STATE_FIELDS, state):
+            setattr(session, field, value)
+        # JSON turns the integer question indices into strings
+        session.answers = {int(index): answer for index, answer in session.answers.items()}
+        return session
+
+    def to_log_record(self):
+        """Get the analytics record for this completed session."""
+        return {
+            "session_id": self.session_id,
+            "started_at": self.started_at,
+            "completed_at": self.completed_at,
+            "answers": {str(index): answer for index, answer in self.answers.items()},
+            "path": self.recommendation["path"],
+            "score": self.recommendation["score"],
+            "recommendation": self.recommendation["recommendation"],
+            "timings": {
+                "answer_seconds": self.answer_times,
+                "recommendation_seconds": self.recommendation_seconds
+            }
+        }
+
+def get_active_sessions():
+    """
+    Get the active session store, snapshotted to disk and lazily restored after a restart
+    (see SESSION_SNAPSHOT_* in .env.template; in production, use Redis or database).
+    """
+    return _service("active_sessions", lambda: SessionStore.from_env(DiagnosticSession.from_state))
 
 def create_diagnostic_session(session_id):
     """Create a new diagnostic session."""
-    session = DiagnosticSession()
-    active_sessions[session_id] = session
+    session = DiagnosticSession(session_id)
+    get_active_sessions()[session_id] = session
     return session.get_current_question()
 
 def get_diagnostic_session(session_id):
     """Get an existing diagnostic session."""
-    return active_sessions.get(session_id)
+    return get_active_sessions().get(session_id)
 
 def answer_diagnostic_question(session_id, answer):
     """Answer a question in a diagnostic session."""
-    session = active_sessions.get(session_id)
+    sessions = get_active_sessions()
+    session = sessions.get(session_id)
     if not session:
         return {"error": "Session not found"}
     
-    return session.answer_question(answer)
+    result = session.answer_question(answer)
+    sessions.mark_dirty(session_id)
+    return result
 
 def get_initial_greeting():
     """Get the initial greeting message."""
@@ -313,7 +369,7 @@ def handle_initial_response(user_message, session_id):
     try:
         # First check if message is router-related using GPT
         scope_check_prompt = f"The user said: '{user_message}'. Is this related to router, WiFi, or internet connectivity issues? Reply with only 'YES' or 'NO'."
-        scope_response = client.chat.completions.create(
+        scope_response = create_chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": AI_PROMPT},
@@ -332,7 +388,7 @@ def handle_initial_response(user_message, session_id):
             }
         
         # Generate empathetic response and start diagnostic
-        empathy_response = client.chat.completions.create(
+        empathy_response = create_chat_completion(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": AI_PROMPT},
@@ -0,0 +1,282 @@
+"""Router photo upload module.
+
+This module streams multipart photo uploads straight to disk in chunks,
+enforcing size limits while the body is read, and hands decoding and
+downscaling to a bounded process pool so Flask workers only do I/O. Callers
+get a job id back immediately and poll for the processed result.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.exceptions import RequestEntityTooLarge, BadRequest
+from werkzeug.formparser import FormDataParser
+
+UPLOAD_DIR = os.getenv("PHOTO_UPLOAD_DIR") or os.path.join(tempfile.gettempdir(), "routethis_uploads")
+MAX_PHOTO_BYTES = int(os.getenv("PHOTO_MAX_BYTES", 15 * 1024 * 1024))
+MAX_DIMENSION = int(os.getenv("PHOTO_MAX_DIMENSION", 1600))
+# Decoded size budget; generous for phone cameras, small enough that a crafted
+# PNG cannot make a worker decode gigapixels and get OOM-killed
+MAX_PIXELS = int(os.getenv("PHOTO_MAX_PIXELS", 50_000_000))
+
+# Room for the multipart boundaries and the small text fields around the photo
+FORM_OVERHEAD_BYTES = 64 * 1024
+TOO_LARGE_MESSAGE = f"Photo exceeds {round(MAX_PHOTO_BYTES / (1024 * 1024), 1):g} MB limit."
+
+
+class QueueFullError(Exception):
+    """Raised when too many photos are already waiting to be processed."""
+
+
+class _CappedFile:
+    """Disk file that refuses writes past `limit` bytes."""
+
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.written = 0
+        self._file = open(path, "wb+")
+
+    def write(self, chunk):
+        self.written += len(chunk)
+        if self.written > self.limit:
+            raise RequestEntityTooLarge(TOO_LARGE_MESSAGE)
+        return self._file.write(chunk)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def receive_photo_upload(request):
+    """
+    Stream a multipart photo upload from `request` to disk.
+
+    The body is never buffered in memory: the photo part is written to the
+    upload directory chunk by chunk as the parser reads it, and parsing stops
+    as soon as the size limit is crossed.
+
+    Args:
+        request: The current Flask request, with the body not yet read
+
+    Returns:
+        tuple: (path of the saved upload, dict of the text form fields)
+
+    Raises:
+        RequestEntityTooLarge: If the body or the photo is over the limit
+        BadRequest: If the body is not multipart or has no single photo part
+    """
+    if request.mimetype != "multipart/form-data":
+        raise BadRequest("Please send multipart/form-data with a 'photo' file field.")
+
+    # Reject from the Content-Length header before reading a single byte
+    if request.content_length is not None and request.content_length > MAX_PHOTO_BYTES + FORM_OVERHEAD_BYTES:
+        raise RequestEntityTooLarge(TOO_LARGE_MESSAGE)
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}.upload")
+    opened = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        if opened:
+            raise BadRequest("Please upload a single photo per request.")
+        opened.append(_CappedFile(upload_path, MAX_PHOTO_BYTES))
+        return opened[0]
+
+    parser = FormDataParser(
+        stream_factory=stream_factory,
+        max_form_memory_size=FORM_OVERHEAD_BYTES,
+        max_form_parts=8,
+        silent=False,
+    )
+
+    try:
+        _, form, files = parser.parse(request.stream, request.mimetype, request.content_length, request.mimetype_params)
+    except ValueError:
+        _discard(opened, upload_path)
+        raise BadRequest("Malformed multipart body.")
+    except Exception:
+        _discard(opened, upload_path)
+        raise
+
+    for storage in files.values():
+        storage.close()
+
+    if "photo" not in files or not opened or opened[0].written == 0:
+        _discard(opened, upload_path)
+        raise BadRequest("Please send the photo in a 'photo' file field.")
+
+    return upload_path, form.to_dict()
+
+
+def _discard(opened, path):
+    for capped in opened:
+        capped.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def process_photo(upload_path, max_dimension, max_pixels=MAX_PIXELS):
+    """
+    Decode, orient and downscale an uploaded photo (runs in a pool process).
+
+    Args:
+        upload_path (str): Raw upload written by receive_photo_upload
+        max_dimension (int): Longest side of the processed image in pixels
+        max_pixels (int): Largest image (width x height) that will be decoded
+
+    Returns:
+        dict: Path and size of the processed JPEG
+
+    Raises:
+        ValueError: If the image is larger than max_pixels
+    """
+    from PIL import Image, ImageOps
+
+    # Pillow only warns between one and two times this limit; make that an error too
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    output_path = os.path.splitext(upload_path)[0] + ".jpg"
+    try:
+        with Image.open(upload_path) as image:
+            # Opening only reads the header, so nothing oversized is ever decoded
+            if image.width * image.height > max_pixels:
+                raise ValueError(f"Image is {image.width}x{image.height}, over the {max_pixels} pixel limit")
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+            image.draft("RGB", (max_dimension, max_dimension))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail((max_dimension, max_dimension))
+            image.save(output_path, "JPEG", quality=85, optimize=True)
+            width, height = image.size
+    finally:
+        os.remove(upload_path)
+
+    return {
+        "path": output_path,
+        "width": width,
+        "height": height,
+        "bytes": os.path.getsize(output_path),
+    }
+
+
+class PhotoJobQueue:
+    """Bounded queue of photo processing jobs backed by a process pool."""
+
+    JOB_TTL_SECONDS = 3600
+
+    def __init__(self, max_workers=2, max_pending=16):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.jobs = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Created on first use so importing the app never starts processes. Spawn
+        # starts each worker from a fresh interpreter instead of forking this
+        # multi-threaded one; workers import app.photos to unpickle the job, and
+        # re-import the main script as __mp_main__, which is why run.py must not
+        # build the app in that case
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _reset_pool(self, broken):
+        """Replace the pool after a worker died (e.g. OOM-killed); call with self._lock held."""
+        if self._executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, upload_path, session_id):
+        """
+        Queue an uploaded photo for processing.
+
+        Args:
+            upload_path (str): Raw upload written by receive_photo_upload
+            session_id (str): Diagnostic session the photo belongs to
+
+        Returns:
+            str: Job id to poll with status()
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting
+        """
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self.jobs.values() if not job["future"].done())
+            if pending >= self.max_pending:
+                raise QueueFullError()
+
+            job_id = uuid.uuid4().hex
+            pool = self._pool()
+            try:
+                future = pool.submit(process_photo, upload_path, MAX_DIMENSION, MAX_PIXELS)
+            except BrokenProcessPool:
+                # A previous job took a worker down with it; start a fresh pool for this one
+                self._reset_pool(pool)
+                pool = self._pool()
+                future = pool.submit(process_photo, upload_path, MAX_DIMENSION, MAX_PIXELS)
+            self.jobs[job_id] = {
+                "future": future,
+                "pool": pool,
+                "session_id": session_id,
+                "upload_path": upload_path,
+                "created": time.time(),
+            }
+            return job_id
+
+    def status(self, job_id):
+        """
+        Get the state of a photo job.
+
+        Returns:
+            dict or None: job_status ("queued" | "processing" | "done" | "failed")
+                          plus the photo details or error, None if unknown
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        result = {"job_id": job_id, "session_id": job["session_id"]}
+        if not future.done():
+            result["job_status"] = "processing" if future.running() else "queued"
+        elif future.exception() is not None:
+            if isinstance(future.exception(), BrokenProcessPool):
+                with self._lock:
+                    self._reset_pool(job["pool"])
+            result["job_status"] = "failed"
+            result["error"] = "Could not read that photo. Please try another one."
+        else:
+            photo = future.result()
+            result["job_status"] = "done"
+            result["photo"] = {"width": photo["width"], "height": photo["height"], "bytes": photo["bytes"]}
+        return result
+
+    def _prune(self):
+        cutoff = time.time() - self.JOB_TTL_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job["future"].done() and job["created"] < cutoff]:
+            job = self.jobs.pop(job_id)
+            paths = [job["upload_path"]]
+            if job["future"].exception() is None:
+                paths.append(job["future"].result()["path"])
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+photo_jobs = PhotoJobQueue(
+    max_workers=int(os.getenv("PHOTO_WORKERS", 2)),
+    max_pending=int(os.getenv("PHOTO_MAX_PENDING", 16)),
+)
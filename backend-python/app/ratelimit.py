@@ -0,0 +1,243 @@
+"""Admission control module.
+
+This module provides token-bucket rate limiting keyed by client IP and
+session id, with separate limits for LLM-backed and graph-only routes, plus a
+cap on in-flight LLM requests per worker. Bucket state can live in memory
+(single worker) or in a SQLite file shared by every worker on the host.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+LLM = "llm"
+GRAPH = "graph"
+
+# Buckets untouched for IDLE_SECONDS have refilled and are dropped every PRUNE_EVERY takes
+PRUNE_EVERY = 1000
+IDLE_SECONDS = 3600
+
+# How long a request waits on a limiter database locked by another worker before failing open
+BUSY_TIMEOUT_MS = 50
+# Opening the file and creating the table happen once per process, when workers often boot
+# together; waiting longer there beats failing to import the app
+SETUP_TIMEOUT_SECONDS = 10.0
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process only."""
+
+    def __init__(self):
+        self.buckets = {}
+        self._takes = 0
+        self._lock = threading.Lock()
+
+    def take(self, specs, now=None):
+        """
+        Take one token from every bucket in `specs`, or from none of them.
+
+        Args:
+            specs (list): (key, rate per second, capacity) tuples
+            now (float): Current time in seconds, defaults to time.time()
+
+        Returns:
+            float: 0.0 if admitted, otherwise seconds until a retry could succeed
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            levels = []
+            for key, rate, capacity in specs:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+
+            retry_after = _retry_after(specs, levels)
+            for (key, _, _), tokens in zip(specs, levels):
+                self.buckets[key] = (tokens - 1.0 if retry_after == 0.0 else tokens, now)
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                cutoff = now - IDLE_SECONDS
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[1] >= cutoff}
+            return retry_after
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file so every worker process shares them."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._takes = 0
+        # One connection per process; Werkzeug serves each request on a new
+        # thread, so a per-thread connection would reconnect on every request
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connect()
+
+    def _connect(self):
+        """Get this process's connection (call with self._lock held)."""
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SETUP_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            # Only the setup above may wait long; takes give up quickly and fail open
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, specs, now=None):
+        """Same contract as MemoryBucketStore.take, serialized across processes."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._take(self._connect(), specs, now)
+
+    def _take(self, conn, specs, now):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, rate, capacity in specs:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                levels.append(min(capacity, tokens + (now - updated) * rate))
+
+            retry_after = _retry_after(specs, levels)
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, tokens - 1.0 if retry_after == 0.0 else tokens, now)
+                 for (key, _, _), tokens in zip(specs, levels)]
+            )
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - IDLE_SECONDS,))
+            conn.execute("COMMIT")
+            return retry_after
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _retry_after(specs, levels):
+    """Seconds until every bucket holds a token, or 0.0 if they already do."""
+    wait = 0.0
+    for (_, rate, _), tokens in zip(specs, levels):
+        if tokens < 1.0:
+            wait = max(wait, (1.0 - tokens) / rate)
+    return wait
+
+
+class AdmissionController:
+    """Decides whether a request is admitted or shed with a 429."""
+
+    def __init__(self, store, limits, max_inflight_llm=8, enabled=True):
+        """
+        Args:
+            store: MemoryBucketStore or SQLiteBucketStore
+            limits (dict): Maps (route class, "ip" | "session") to (per minute, burst)
+            max_inflight_llm (int): Concurrent LLM requests allowed in this worker
+            enabled (bool): When False every request is admitted
+        """
+        self.store = store
+        self.limits = limits
+        self.enabled = enabled
+        self.max_inflight_llm = max_inflight_llm
+        self._inflight = threading.BoundedSemaphore(max_inflight_llm)
+        self.counters = {f"{route_class}_{outcome}": 0
+                         for route_class in [LLM, GRAPH]
+                         for outcome in ["admitted", "shed_rate", "shed_busy", "errors"]}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a controller from the RATE_LIMIT_* environment variables."""
+        def limit(name, per_minute, burst):
+            return (float(os.getenv(f"RATE_LIMIT_{name}_PER_MINUTE", per_minute)),
+                    float(os.getenv(f"RATE_LIMIT_{name}_BURST", burst)))
+
+        db_path = os.getenv("RATE_LIMIT_DB") or os.path.join(tempfile.gettempdir(), "routethis_ratelimit.db")
+        store = MemoryBucketStore() if db_path == "memory" else SQLiteBucketStore(db_path)
+
+        return cls(
+            store=store,
+            limits={
+                (LLM, "ip"): limit("LLM_IP", 30, 10),
+                (LLM, "session"): limit("LLM_SESSION", 10, 5),
+                (GRAPH, "ip"): limit("GRAPH_IP", 300, 60),
+                (GRAPH, "session"): limit("GRAPH_SESSION", 120, 30),
+            },
+            max_inflight_llm=int(os.getenv("RATE_LIMIT_LLM_MAX_INFLIGHT", 8)),
+            enabled=os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ["1", "true", "yes"],
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def admit(self, route_class, client_ip, session_id=None):
+        """
+        Check the client's buckets and, for LLM routes, reserve an in-flight slot.
+
+        Args:
+            route_class (str): LLM or GRAPH
+            client_ip (str): Remote address of the client
+            session_id (str or callable): Session identifier, if the request carries
+                one. A callable (e.g. one that parses the body) is only called once
+                the IP bucket has admitted the request, so shed clients cost no body read.
+
+        Returns:
+            tuple: (admitted, retry_after_seconds). Admitted LLM requests must
+                   call release() when they finish.
+        """
+        if not self.enabled:
+            return True, 0.0
+
+        # Check the in-flight cap first so a busy worker does not also drain the client's tokens
+        if route_class == LLM and not self._inflight.acquire(blocking=False):
+            self._count(f"{route_class}_shed_busy")
+            return False, 1.0
+
+        if callable(session_id):
+            # The IP bucket is charged even if the session bucket then sheds the request
+            retry_after = self._take(route_class, [("ip", client_ip)])
+            if retry_after == 0.0:
+                retry_after = self._take(route_class, [("session", session_id())])
+        else:
+            retry_after = self._take(route_class, [("ip", client_ip), ("session", session_id)])
+
+        if retry_after > 0.0:
+            if route_class == LLM:
+                self._inflight.release()
+            self._count(f"{route_class}_shed_rate")
+            return False, retry_after
+
+        self._count(f"{route_class}_admitted")
+        return True, 0.0
+
+    def _take(self, route_class, scoped_keys):
+        specs = []
+        for scope, key in scoped_keys:
+            if key:
+                per_minute, burst = self.limits[(route_class, scope)]
+                specs.append((f"{route_class}:{scope}:{key}", per_minute / 60.0, burst))
+        if not specs:
+            return 0.0
+
+        try:
+            return self.store.take(specs)
+        except sqlite3.Error:
+            # Fail open: a busy limiter database must not take the API down with it
+            self._count(f"{route_class}_errors")
+            return 0.0
+
+    def release(self):
+        """Free the in-flight slot reserved by an admitted LLM request."""
+        self._inflight.release()
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {"enabled": self.enabled, "max_inflight_llm": self.max_inflight_llm, **counters}
@@ -3,11 +3,54 @@
 This module contains all the route definitions and handlers for the Flask application.
 """
 
-from flask import Blueprint, render_template, request, jsonify
-from .logic import get_gpt_response, get_diagnostic_recommendation, get_next_question, create_diagnostic_session, answer_diagnostic_question, get_diagnostic_session, get_initial_greeting, handle_initial_response
+import os
+
+from flask import Blueprint, render_template, request, jsonify, g
+from .logic import get_gpt_response, get_diagnostic_recommendation, get_next_question, create_diagnostic_session, answer_diagnostic_question, get_diagnostic_session, get_initial_greeting, handle_initial_response, get_llm_metrics, get_analytics_metrics, get_session_store_metrics
+from .ratelimit import AdmissionController, LLM, GRAPH
+from .photos import receive_photo_upload, photo_jobs, QueueFullError
+from werkzeug.exceptions import HTTPException
 from icecream import ic
 bp = Blueprint("main", __name__)
 
+# Shared across workers through RATE_LIMIT_DB (see .env.template)
+admission = AdmissionController.from_env()
+
+LLM_ENDPOINTS = {"main.message", "main.initial_response"}
+UNLIMITED_ENDPOINTS = {"main.home", "main.health_check", "main.metrics"}
+
+@bp.before_request
+def admission_control():
+    """Shed requests over the client's rate limit, or over the LLM in-flight cap, with a 429."""
+    if request.method == "OPTIONS" or request.endpoint in UNLIMITED_ENDPOINTS:
+        return None
+
+    route_class = LLM if request.endpoint in LLM_ENDPOINTS else GRAPH
+
+    def session_id_from_body():
+        data = request.get_json(silent=True) if request.is_json else None
+        return data.get("session_id") if isinstance(data, dict) else None
+
+    # The body is only read once the client's IP bucket has admitted the request
+    session_id = ((request.view_args or {}).get("session_id")
+                  or request.args.get("session_id")
+                  or request.headers.get("X-Session-Id")
+                  or session_id_from_body)
+
+    admitted, retry_after = admission.admit(route_class, request.remote_addr, session_id)
+    if not admitted:
+        response = jsonify({"error": "Too many requests. Please slow down and try again shortly."})
+        response.headers["Retry-After"] = str(max(1, round(retry_after)))
+        return response, 429
+
+    g.holds_llm_slot = route_class == LLM and admission.enabled
+    return None
+
+@bp.teardown_request
+def release_llm_slot(exc):
+    if g.pop("holds_llm_slot", False):
+        admission.release()
+
 @bp.route("/")
 def home():
     return render_template("index.html")
@@ -17,6 +60,27 @@ def home():
 def health_check():
     return {"status": "healthy"}
 
+@bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Get upstream LLM call, admission control, session analytics and session store metrics.
+    
+    Returns:
+    {
+        "llm": {"hedge_rate": float, "win_rate": float, ...},
+        "admission": {"llm_admitted": int, "llm_shed_rate": int, ...},
+        "analytics": {"written": int, "dropped": int, "queue_depth": int, ...},
+        "sessions": {"in_memory": int, "dirty": int, "restored": int, ...}
+    }
+    """
+    return jsonify({
+        "llm": get_llm_metrics(),
+        "admission": admission.metrics(),
+        "analytics": get_analytics_metrics(),
+        "sessions": get_session_store_metrics(),
+        "status": "success"
+    })
+
 @bp.route("/message", methods=["POST"])
 def message():
     """
@@ -251,34 +315,70 @@ def answer_question():
     })
 
 
-# @bp.route("/diagnostic/restart_instructions/photo_upload", methods=["POST"])
-# def answer_question():
-#
-#     data = request.get_json()
-#
-#     if not data or "session_id" not in data or "answer" not in data:
-#         return jsonify({
-#             "error": "Please send JSON with 'session_id' and 'answer' fields",
-#             "example": {"session_id": "user123_session456", "answer": True}
-#         }), 400
-#
-#     session_id = data["session_id"]
-#     ic(data["answer"], session_id)
-#     # answer = bool(data["answer"])
-#     answer = data["answer"]
-#
-#     result = answer_diagnostic_question(session_id, answer)
-#
-#     if "error" in result:
-#         return jsonify(result), 400
-#
-#     return jsonify({
-#         "complete": result["complete"],
-#         "next_question": result.get("next_question"),
-#         "recommendation": result.get("recommendation"),
-#         "status": "success"
-#     })
+@bp.route("/diagnostic/restart_instructions/photo_upload", methods=["POST"])
+def upload_router_photo():
+    """
+    Upload a photo of the router for the restart instructions step.
+    
+    The photo is streamed to disk and processed in the background; poll the
+    returned job id for the result. The session is checked before any of the
+    body is read, so it is passed in the query string or a header.
+    
+    Expected request:
+        POST /diagnostic/restart_instructions/photo_upload?session_id=<id>
+        (or an X-Session-Id header)
+        multipart/form-data with photo: <image file>
+    
+    Returns (202):
+    {
+        "job_id": "job identifier",
+        "job_status": "queued"
+    }
+    """
+    session_id = request.args.get("session_id") or request.headers.get("X-Session-Id")
+    if not session_id or not get_diagnostic_session(session_id):
+        return jsonify({
+            "error": "Session not found. Pass an active session in the 'session_id' query parameter or X-Session-Id header.",
+            "example": "/diagnostic/restart_instructions/photo_upload?session_id=user123_session456"
+        }), 400
+    
+    try:
+        upload_path, _ = receive_photo_upload(request)
+    except HTTPException as e:
+        return jsonify({"error": e.description}), e.code
+    
+    try:
+        job_id = photo_jobs.submit(upload_path, session_id)
+    except QueueFullError:
+        os.remove(upload_path)
+        response = jsonify({"error": "Too many photos are being processed. Please try again shortly."})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    
+    return jsonify({
+        "job_id": job_id,
+        "job_status": "queued",
+        "status": "success"
+    }), 202
 
+@bp.route("/diagnostic/restart_instructions/photo_upload/<job_id>", methods=["GET"])
+def get_router_photo_status(job_id):
+    """
+    Get the processing status of an uploaded router photo.
+    
+    Returns:
+    {
+        "job_id": "job identifier",
+        "job_status": "queued" | "processing" | "done" | "failed",
+        "photo": {"width": int, "height": int, "bytes": int} or absent
+    }
+    """
+    result = photo_jobs.status(job_id)
+    
+    if result is None:
+        return jsonify({"error": "Photo job not found"}), 404
+    
+    return jsonify({**result, "status": "success"})
 
 
 @bp.route("/diagnostic/status/<session_id>", methods=["GET"])
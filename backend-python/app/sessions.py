@@ -0,0 +1,361 @@
+"""Session store module.
+
+This module keeps active diagnostic sessions in memory and periodically
+snapshots the ones that changed to a local SQLite file, so sessions survive
+deploys and crashes. Restore is lazy: booting only opens the file, and a
+session is read back the first time it is asked for, so startup time does not
+grow with the number of saved sessions.
+
+Several workers may share one file, but each keeps its own in-memory copies.
+Every saved row carries a version, and a worker only overwrites the version its
+copy was based on. A worker holding an outdated copy never overwrites a newer
+save; it drops its copy (counted as a conflict) and reads the saved one back on
+next access. The answer it took meanwhile is lost, so route each session to one
+worker (sticky sessions) when running several.
+
+Benchmark with:
+    python -m app.sessions --sessions 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Kept next to the app (Flask's instance folder) rather than in the temp dir,
+# which is often cleared on reboot or is per-container
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "session_snapshot.db")
+
+
+class SessionStore:
+    """Dict-like session store with incremental snapshots and lazy restore."""
+
+    # Rows per snapshot transaction, so a large snapshot never builds one huge
+    # batch in memory and request threads get the GIL back between chunks
+    CHUNK_SIZE = 10000
+
+    def __init__(self, path, restore, interval=5.0, ttl=86400.0):
+        """
+        Args:
+            path (str): SQLite snapshot file
+            restore (callable): Builds a session from (session_id, state)
+            interval (float): Seconds between background snapshots; 0 disables the thread
+            ttl (float): Saved sessions untouched for this long are pruned
+        """
+        self.path = path
+        self.restore = restore
+        self.interval = interval
+        self.ttl = ttl
+        self._sessions = {}
+        # Saved version each in-memory copy is based on; None replaces whatever is saved
+        self._versions = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        # One connection per process, like the rate limiter's; Werkzeug serves each
+        # request on a new thread, so a per-thread connection would reopen the file
+        # on every restore miss
+        self._conn = None
+        self._pid = None
+        self._db_lock = threading.Lock()
+        self.counters = {"snapshots": 0, "snapshot_rows": 0, "restored": 0, "snapshot_errors": 0, "conflicts": 0}
+        self.last_snapshot_seconds = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT, version INTEGER NOT NULL DEFAULT 0, updated_at REAL) WITHOUT ROWID")
+            if "version" not in [column[1] for column in conn.execute("PRAGMA table_info(sessions)")]:
+                # Files written before rows were versioned
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+        self._stop = threading.Event()
+        self._thread = None
+        if interval > 0:
+            self._thread = threading.Thread(target=self._run, name="session-snapshot", daemon=True)
+            self._thread.start()
+
+    @classmethod
+    def from_env(cls, restore):
+        """Build a store from the SESSION_SNAPSHOT_* environment variables."""
+        return cls(
+            path=os.getenv("SESSION_SNAPSHOT_DB") or DEFAULT_PATH,
+            restore=restore,
+            interval=float(os.getenv("SESSION_SNAPSHOT_INTERVAL", 5.0)),
+            ttl=float(os.getenv("SESSION_SNAPSHOT_TTL", 86400)),
+        )
+
+    def _connect(self):
+        """Get this process's connection (call with self._db_lock held)."""
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def __setitem__(self, session_id, session):
+        with self._lock:
+            self._sessions[session_id] = session
+            self._versions[session_id] = None
+            self._dirty.add(session_id)
+
+    def __len__(self):
+        """Number of sessions loaded in memory (not counting unrestored ones)."""
+        return len(self._sessions)
+
+    def get(self, session_id, default=None):
+        """
+        Get a session, restoring it from the snapshot on first access.
+
+        Returns:
+            The session, or `default` if it is neither in memory nor saved
+        """
+        session = self._sessions.get(session_id)
+        if session is not None:
+            return session
+
+        with self._db_lock:
+            row = self._connect().execute("SELECT state, version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return default
+
+        restored = self.restore(session_id, json.loads(row[0]))
+        with self._lock:
+            # Another thread may have restored or replaced it meanwhile; keep theirs
+            session = self._sessions.setdefault(session_id, restored)
+            if session is restored:
+                self._versions[session_id] = row[1]
+                self.counters["restored"] += 1
+        return session
+
+    def mark_dirty(self, session_id):
+        """Flag a session as changed so the next snapshot saves it."""
+        with self._lock:
+            if session_id in self._sessions:
+                self._dirty.add(session_id)
+
+    def snapshot(self):
+        """
+        Save every session changed since the last snapshot.
+
+        Returns:
+            int: Number of sessions written
+        """
+        with self._snapshot_lock:
+            # Connect before taking the dirty set, so a failure here loses nothing
+            with self._db_lock:
+                conn = self._connect()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+
+            if not dirty:
+                return 0
+
+            start = time.perf_counter()
+            now = time.time()
+            # Key order keeps each chunk's writes to a contiguous run of B-tree pages
+            dirty = sorted(dirty)
+            written = 0
+
+            for offset in range(0, len(dirty), self.CHUNK_SIZE):
+                chunk = dirty[offset:offset + self.CHUNK_SIZE]
+                rows = []
+                failed = []
+                for session_id in chunk:
+                    with self._lock:
+                        session = self._sessions.get(session_id)
+                        base = self._versions.get(session_id)
+                    if session is None:
+                        continue
+                    try:
+                        rows.append((session_id, json.dumps(session.to_state(), separators=(",", ":")), base))
+                    except Exception:
+                        # One unserializable session must not cost the rest of the snapshot
+                        failed.append(session_id)
+                if failed:
+                    with self._lock:
+                        self._dirty.update(failed)
+                        self.counters["snapshot_errors"] += len(failed)
+                # Serialized outside the database lock, so restores only wait for the write
+                with self._db_lock:
+                    try:
+                        # Immediate, so no other worker writes between reading a version and replacing it
+                        conn.execute("BEGIN IMMEDIATE")
+                        saved, conflicts = self._write_rows(conn, rows, now)
+                        conn.execute("COMMIT")
+                    except Exception:
+                        # Put the unsaved ones back so the next snapshot retries them
+                        with self._lock:
+                            self._dirty.update(dirty[offset:])
+                            self.counters["snapshot_errors"] += 1
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                        return written
+
+                with self._lock:
+                    for session_id, version in saved:
+                        self._versions[session_id] = version
+                    for session_id in conflicts:
+                        # Another worker saved a newer version; read that back on next access
+                        self._sessions.pop(session_id, None)
+                        self._versions.pop(session_id, None)
+                        self._dirty.discard(session_id)
+                    self.counters["conflicts"] += len(conflicts)
+                written += len(saved)
+                time.sleep(0)
+
+            with self._db_lock:
+                try:
+                    conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+                except sqlite3.Error:
+                    pass
+
+            with self._lock:
+                self.counters["snapshots"] += 1
+                self.counters["snapshot_rows"] += written
+            self.last_snapshot_seconds = time.perf_counter() - start
+            return written
+
+    def _write_rows(self, conn, rows, now):
+        """
+        Save (session_id, state, base version) rows inside an open transaction.
+
+        A row is only written if the saved version is still the one the copy was
+        based on; a base of None replaces whatever is saved.
+
+        Returns:
+            tuple: (list of (session_id, new version) written, list of conflicting session ids)
+        """
+        saved, conflicts = [], []
+        for session_id, state, base in rows:
+            if base is None:
+                current = conn.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()
+                base = current[0] if current else 0
+            cursor = conn.execute(
+                "INSERT INTO sessions (id, state, version, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET state = excluded.state, version = excluded.version, updated_at = excluded.updated_at "
+                "WHERE sessions.version = ?",
+                (session_id, state, base + 1, now, base)
+            )
+            if cursor.rowcount:
+                saved.append((session_id, base + 1))
+            else:
+                conflicts.append(session_id)
+        return saved, conflicts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # snapshot() re-queues what it could not save; anything else it raises is
+            # counted here so the thread keeps running
+            try:
+                self.snapshot()
+            except Exception:
+                with self._lock:
+                    self.counters["snapshot_errors"] += 1
+
+    def close(self):
+        """Stop the background thread and take a final snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + 1.0)
+        self.snapshot()
+        # Fold the write-ahead log back in so the next boot opens a single compact file
+        with self._db_lock:
+            try:
+                self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+            dirty = len(self._dirty)
+        return {
+            **counters,
+            "in_memory": len(self._sessions),
+            "dirty": dirty,
+            "last_snapshot_seconds": self.last_snapshot_seconds,
+        }
+
+
+def benchmark(num_sessions, path, changed_fraction=0.01, lookups=10000):
+    """
+    Time a full snapshot, an incremental snapshot, a cold boot and lazy restores.
+
+    Args:
+        num_sessions (int): Sessions to create
+        path (str): Snapshot file to use (overwritten)
+        changed_fraction (float): Share of sessions changed before the incremental snapshot
+        lookups (int): Random sessions restored after the cold boot
+
+    Returns:
+        dict: Timings in seconds and the snapshot file size
+    """
+    from .logic import DiagnosticSession
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(0)
+    answers = ["yes", "no", "?"]
+    results = {"sessions": num_sessions}
+
+    store = SessionStore(path, DiagnosticSession.from_state, interval=0)
+    start = time.perf_counter()
+    for index in range(num_sessions):
+        session = DiagnosticSession(f"session-{index}")
+        for question in range(rng.randint(0, 5)):
+            session.answers[question] = rng.choice(answers)
+            session.answer_times.append(question * 4.0)
+        session.current_question_index = len(session.answers)
+        store[f"session-{index}"] = session
+    results["create_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store.snapshot()
+    results["full_snapshot_seconds"] = time.perf_counter() - start
+
+    changed = rng.sample(range(num_sessions), int(num_sessions * changed_fraction))
+    for index in changed:
+        session = store.get(f"session-{index}")
+        session.answers[session.current_question_index] = "yes"
+        session.current_question_index += 1
+        store.mark_dirty(f"session-{index}")
+    start = time.perf_counter()
+    results["incremental_rows"] = store.snapshot()
+    results["incremental_snapshot_seconds"] = time.perf_counter() - start
+    store.close()
+
+    start = time.perf_counter()
+    booted = SessionStore(path, DiagnosticSession.from_state, interval=0)
+    results["boot_seconds"] = time.perf_counter() - start
+
+    keys = [f"session-{rng.randrange(num_sessions)}" for _ in range(lookups)]
+    start = time.perf_counter()
+    for key in keys:
+        booted.get(key)
+    elapsed = time.perf_counter() - start
+    results["lazy_restore_mean_ms"] = elapsed / lookups * 1000
+
+    check = changed[0] if changed else 0
+    assert booted.get(f"session-{check}").to_state() == store.get(f"session-{check}").to_state()
+
+    results["snapshot_bytes"] = sum(os.path.getsize(path + suffix) for suffix in ["", "-wal"] if os.path.exists(path + suffix))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark session snapshot and lazy restore.")
+    parser.add_argument("--sessions", type=int, default=1000000)
+    parser.add_argument("--path", default=os.path.join(tempfile.gettempdir(), "routethis_session_bench.db"))
+    args = parser.parse_args()
+
+    for name, value in benchmark(args.sessions, args.path).items():
+        print(f"{name}: {value:.4f}" if isinstance(value, float) else f"{name}: {value}")
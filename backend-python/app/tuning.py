@@ -0,0 +1,355 @@
+"""Offline edge-weight tuning module.
+
+This module is a command line tool that searches for diagnostic graph edge
+weights maximizing recommendation accuracy over a log of answer sets with
+known outcomes, then writes a graph definition that the app can load through
+DIAGNOSTIC_GRAPH_PATH plus an accuracy/timing report.
+
+The path a session takes through the graph depends only on its answers, never
+on the weights, so every session reduces to a vector of edge traversal counts
+and its score under any weighting is a dot product. Sessions with the same
+counts are merged, and whole batches of candidate weightings are scored with
+one matrix product, spread over a process pool.
+
+A share of the sessions (--holdout) is set aside before the search, and the
+reported accuracies are measured on it. Tuned weights are only written if they
+beat the current ones on those held-out sessions.
+
+Usage:
+    python -m app.tuning sessions.jsonl --output tuned_graph.json --report tuning_report.json
+
+Each log line is a JSON object such as:
+    {"answers": {"0": "yes", "1": "no", "3": "?"}, "outcome": "RESTART_ROUTER"}
+where outcome is the recommendation that turned out to be correct
+("RESTART_ROUTER" or "CONTACT_SUPPORT").
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .graph import DEFAULT_EDGES, RouterDiagnosticGraph
+
+# Answer codes, mirroring how RouterDiagnosticGraph.get_recommendation reads answers
+NO, YES, UNSURE, STOP = 0, 1, 2, 3
+
+
+def encode_answer(answer):
+    """Map a logged answer to an answer code; anything unrecognized ends the walk."""
+    if isinstance(answer, bool):
+        return YES if answer else NO
+    answer = str(answer).lower()
+    if answer in ["yes", "y", "true", "t"]:
+        return YES
+    if answer in ["no", "n", "false", "f"]:
+        return NO
+    if answer == "?":
+        return UNSURE
+    return STOP
+
+
+def load_sessions(path, num_questions):
+    """
+    Read a JSONL session log and count each distinct (answers, outcome) pair.
+
+    Args:
+        path (str): Path to the log
+        num_questions (int): Number of answerable questions
+
+    Returns:
+        tuple: (Counter mapping (answer codes, restart_was_correct) to a count,
+                number of sessions read)
+    """
+    counts = Counter()
+    total = 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            answers = record["answers"]
+            codes = [STOP] * num_questions
+            for key, value in answers.items():
+                index = int(key)
+                if 0 <= index < num_questions:
+                    codes[index] = encode_answer(value)
+            counts[(tuple(codes), record["outcome"] == "RESTART_ROUTER")] += 1
+            total += 1
+    return counts, total
+
+
+def split_sessions(session_counts, holdout, seed=0):
+    """
+    Randomly set aside a share of the sessions for evaluation.
+
+    Each session is held out independently with probability `holdout`, so
+    identical sessions can land on both sides.
+
+    Args:
+        session_counts (Counter): Output of load_sessions
+        holdout (float): Share of sessions to hold out, between 0 and 1
+        seed (int): Random seed
+
+    Returns:
+        tuple: (training Counter, held-out Counter)
+    """
+    rng = np.random.default_rng(seed)
+    train, held_out = Counter(), Counter()
+    for key, count in sorted(session_counts.items()):
+        held = int(rng.binomial(count, holdout))
+        if held:
+            held_out[key] = held
+        if count - held:
+            train[key] = count - held
+    return train, held_out
+
+
+def out_edge_table(edges, num_nodes):
+    """
+    Index outgoing edges by source node, in the order networkx iterates them.
+
+    Returns:
+        dict: Source node -> list of (edge index, target node, answer)
+    """
+    out_edges = {}
+    for index, (source, target, answer, _) in enumerate(edges):
+        out_edges.setdefault(source % num_nodes, []).append((index, target % num_nodes, answer))
+    # networkx lists a node's out-edges grouped by target, in order of first insertion
+    for out in out_edges.values():
+        first_seen = {}
+        for _, target, _ in out:
+            first_seen.setdefault(target, len(first_seen))
+        out.sort(key=lambda edge: first_seen[edge[1]])
+    return out_edges
+
+
+def edge_counts(codes, out_edges, num_edges, end):
+    """
+    Walk the graph for one answer set and count how often each edge adds its weight.
+
+    Follows the same rules as RouterDiagnosticGraph.get_recommendation: a yes/no
+    answer takes the matching edge, "?" adds every outgoing edge and moves to the
+    first one's target, and a missing answer stops the walk.
+
+    Args:
+        codes (tuple): Answer code per question
+        out_edges (dict): Output of out_edge_table
+        num_edges (int): Number of edges
+        end (int): Index of the "Run Algorithm" node
+
+    Returns:
+        list: Traversal count per edge
+    """
+    counts = [0] * num_edges
+    node = 0
+    while node != end:
+        code = codes[node]
+        out = out_edges.get(node)
+        if code == STOP or not out:
+            break
+        if code == UNSURE:
+            for index, _, _ in out:
+                counts[index] += 1
+            node = out[0][1]
+            continue
+        match = next((edge for edge in out if edge[2] == (code == YES)), None)
+        if match is None:
+            break
+        counts[match[0]] += 1
+        node = match[1]
+    return counts
+
+
+def build_features(session_counts, edges, num_nodes):
+    """
+    Collapse sessions into unique edge-count rows with outcome tallies.
+
+    Returns:
+        tuple: (features float32 [rows, edges], restart-correct counts per row,
+                support-correct counts per row)
+    """
+    out_edges = out_edge_table(edges, num_nodes)
+    rows = {}
+    for (codes, restart_correct), count in session_counts.items():
+        key = tuple(edge_counts(codes, out_edges, len(edges), num_nodes - 1))
+        tally = rows.setdefault(key, [0, 0])
+        tally[0 if restart_correct else 1] += count
+
+    features = np.array(list(rows.keys()), dtype=np.float32).reshape(len(rows), len(edges))
+    tallies = np.array(list(rows.values()), dtype=np.float64).reshape(len(rows), 2)
+    return features, tallies[:, 0], tallies[:, 1]
+
+
+_features = None
+_restarts = None
+_supports = None
+
+
+def _init_worker(features, restarts, supports):
+    global _features, _restarts, _supports
+    _features, _restarts, _supports = features, restarts, supports
+
+
+def correct_counts(features, restarts, supports, weights):
+    """Number of correctly recommended sessions for each candidate row in `weights`."""
+    restart = (features @ weights.T.astype(np.float32)) >= 0
+    return (restart * restarts[:, None] + ~restart * supports[:, None]).sum(axis=0)
+
+
+def _score_chunk(weights):
+    return correct_counts(_features, _restarts, _supports, weights)
+
+
+def search(features, restarts, supports, baseline, candidates, rounds, weight_range, workers, seed=0):
+    """
+    Evolutionary search over integer edge weights.
+
+    The first round samples weights uniformly in [-weight_range, weight_range]
+    alongside the baseline; later rounds mutate the best weightings so far.
+
+    Args:
+        features, restarts, supports: Output of build_features
+        baseline (np.ndarray): Current edge weights
+        candidates (int): Total weightings to evaluate
+        rounds (int): Number of generations
+        weight_range (int): Largest absolute weight allowed
+        workers (int): Process pool size
+        seed (int): Random seed
+
+    Returns:
+        tuple: (best weights, best correct count, baseline correct count, candidates evaluated)
+    """
+    rng = np.random.default_rng(seed)
+    num_edges = len(baseline)
+    per_round = max(1, candidates // rounds)
+    elite_size = max(8, per_round // 20)
+
+    population = np.vstack([
+        baseline[None, :],
+        rng.integers(-weight_range, weight_range + 1, size=(per_round - 1, num_edges))
+    ])
+    pool_weights = np.empty((0, num_edges), dtype=np.int64)
+    pool_scores = np.empty(0)
+    evaluated = 0
+    baseline_correct = None
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(features, restarts, supports)) as pool:
+        for round_index in range(rounds):
+            chunks = np.array_split(population, min(workers * 4, len(population)))
+            scores = np.concatenate(list(pool.map(_score_chunk, chunks)))
+            evaluated += len(population)
+            if baseline_correct is None:
+                baseline_correct = scores[0]
+
+            # Keep the elite, preferring weightings closer to the baseline on ties
+            pool_weights = np.vstack([pool_weights, population])
+            pool_scores = np.concatenate([pool_scores, scores])
+            distance = np.abs(pool_weights - baseline).sum(axis=1)
+            order = np.lexsort((distance, -pool_scores))[:elite_size]
+            pool_weights, pool_scores = pool_weights[order], pool_scores[order]
+
+            if round_index == rounds - 1:
+                break
+            parents = pool_weights[rng.integers(len(pool_weights), size=per_round)]
+            mask = rng.random(parents.shape) < 2.0 / num_edges
+            steps = rng.integers(-2, 3, size=parents.shape)
+            population = np.clip(parents + mask * steps, -weight_range, weight_range)
+
+    return pool_weights[0], pool_scores[0], baseline_correct, evaluated
+
+
+def graph_definition(graph, edges, weights):
+    """Graph definition JSON in the form read by graph.load_graph_definition."""
+    return {
+        "questions": graph.questions,
+        "edges": [
+            {"source": source, "target": target, "answer": answer, "weight": int(weight)}
+            for (source, target, answer, _), weight in zip(edges, weights)
+        ]
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune diagnostic graph edge weights against logged session outcomes.")
+    parser.add_argument("log", help="JSONL file of {\"answers\": {...}, \"outcome\": ...} records")
+    parser.add_argument("--output", default="tuned_graph.json", help="Where to write the tuned graph definition")
+    parser.add_argument("--report", default="tuning_report.json", help="Where to write the accuracy/timing report")
+    parser.add_argument("--candidates", type=int, default=5000, help="Total weightings to evaluate")
+    parser.add_argument("--rounds", type=int, default=10, help="Search generations")
+    parser.add_argument("--weight-range", type=int, default=10, help="Largest absolute edge weight")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Process pool size")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of sessions held out to measure accuracy")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    graph = RouterDiagnosticGraph()
+    edges = DEFAULT_EDGES
+    num_nodes = len(graph.questions)
+    timings = {}
+
+    start = time.perf_counter()
+    session_counts, total = load_sessions(args.log, num_nodes - 1)
+    timings["load_seconds"] = time.perf_counter() - start
+
+    train_counts, held_out_counts = split_sessions(session_counts, args.holdout, args.seed)
+    train_total, held_out_total = sum(train_counts.values()), sum(held_out_counts.values())
+    if not train_total or not held_out_total:
+        parser.error(f"--holdout {args.holdout} leaves no training or no held-out sessions out of {total}")
+
+    start = time.perf_counter()
+    features, restarts, supports = build_features(train_counts, edges, num_nodes)
+    held_out = build_features(held_out_counts, edges, num_nodes)
+    timings["featurize_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    baseline = np.array([weight for _, _, _, weight in edges], dtype=np.int64)
+    best, best_correct, baseline_correct, evaluated = search(
+        features, restarts, supports, baseline,
+        args.candidates, args.rounds, args.weight_range, args.workers, args.seed
+    )
+    timings["search_seconds"] = time.perf_counter() - start
+
+    # Judge the weights only on sessions the search never saw
+    held_out_baseline, held_out_tuned = correct_counts(*held_out, np.vstack([baseline, best])) / held_out_total
+    improved = held_out_tuned > held_out_baseline
+    written = best if improved else baseline
+
+    with open(args.output, "w") as f:
+        json.dump(graph_definition(graph, edges, written), f, indent=2)
+
+    report = {
+        "sessions": total,
+        "train_sessions": train_total,
+        "held_out_sessions": held_out_total,
+        "unique_paths": len(features),
+        "candidates_evaluated": evaluated,
+        "workers": args.workers,
+        "baseline_accuracy": float(held_out_baseline),
+        "tuned_accuracy": float(held_out_tuned),
+        "train_baseline_accuracy": float(baseline_correct / train_total),
+        "train_tuned_accuracy": float(best_correct / train_total),
+        "wrote_tuned_weights": bool(improved),
+        "baseline_weights": baseline.tolist(),
+        "tuned_weights": best.tolist(),
+        "timings": timings,
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Sessions: {total} ({train_total} train, {held_out_total} held out; {len(features)} unique training paths), candidates: {evaluated}")
+    print(f"Held-out accuracy: {report['baseline_accuracy']:.4f} -> {report['tuned_accuracy']:.4f} "
+          f"(training: {report['train_baseline_accuracy']:.4f} -> {report['train_tuned_accuracy']:.4f})")
+    if not improved:
+        print("Tuned weights did not beat the current ones on held-out sessions; writing the current weights")
+    print(f"Time: load {timings['load_seconds']:.1f}s, featurize {timings['featurize_seconds']:.1f}s, search {timings['search_seconds']:.1f}s")
+    print(f"Wrote {args.output} and {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
 import os
 from app import create_app
 
-app = create_app()
+# Photo processing workers are spawned processes that re-import this script as
+# __mp_main__; they only need app.photos, not a second app and its background services
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True, port=int(os.getenv('FLASK_PORT', 5000)) )
\ No newline at end of file